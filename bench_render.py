@@ -0,0 +1,201 @@
+# Measures how many calls into curses render_main_grid makes per frame, and
+# how long a frame takes, on a generated 21x21 grid, next to the per-cell
+# renderer it replaced. Frames are drawn into real curses windows, in a
+# pseudo-terminal big enough for the grid, and the cursor moves on after
+# every frame so that each refresh has something new to send.
+#
+#     $ python3 bench_render.py [size] [frames]
+
+import curses
+import fcntl
+import json
+import os
+import pty
+import struct
+import sys
+import termios
+import time
+import traceback
+
+from xword import BLACK, EDGES, EMPTY, SHADE, SHAPES, VERTICES, Puzzle
+
+class CountingWindow:
+    def __init__(self):
+        self.calls = 0
+
+    def addstr(self, *args):
+        self.calls += 1
+
+    def erase(self):
+        pass
+
+    def refresh(self):
+        pass
+
+def generate(size, filled=True):
+    # Black squares on a diagonal lattice, filled in halfway or not at all
+    answer = [[BLACK if (x + 2*y) % 7 == 3 and 0 < x < size-1 else 'A'
+               for x in range(size)]
+              for y in range(size)]
+    buffer = [[BLACK if letter == BLACK else EMPTY if (x + y) % 2 or not filled else 'A'
+               for x, letter in enumerate(row)]
+              for y, row in enumerate(answer)]
+    cluelist = (f'Clue {i}' for i in range(size * size))
+    return Puzzle(answer, buffer, cluelist, 'Benchmark', '', '', [])
+
+def render_per_cell(puzzle):
+    # Puzzle.render_main_grid as it was before it batched its output,
+    # with one addstr per piece of every square
+    puzzle.main_grid.erase()
+
+    span       = puzzle.clue.span
+    boldnesses = {}
+    if puzzle.direction == 'across':
+        x, y = span[0]
+        boldnesses[(x, y    )] = 'topleft'
+        boldnesses[(x, y + 1)] = 'bottomleft'
+        for x, y in span[1:]:
+            boldnesses[(x, y    )] = 'horizontal'
+            boldnesses[(x, y + 1)] = 'horizontal'
+        x, y = span[-1]
+        boldnesses[(x + 1, y    )] = 'topright'
+        boldnesses[(x + 1, y + 1)] = 'bottomright'
+    else:
+        x, y = span[0]
+        boldnesses[(x,     y)] = 'topleft'
+        boldnesses[(x + 1, y)] = 'topright'
+        for x, y in span[1:]:
+            boldnesses[(x,     y)] = 'vertical'
+            boldnesses[(x + 1, y)] = 'vertical'
+        x, y = span[-1]
+        boldnesses[(x,     y + 1)] = 'bottomleft'
+        boldnesses[(x + 1, y + 1)] = 'bottomright'
+
+    vertices = []
+    for y in range(puzzle.height + 1):
+        row = []
+        for x in range(puzzle.width + 1):
+            xpos     = {0: 'head', puzzle.width:  'tail'}.get(x, 'body')
+            ypos     = {0: 'head', puzzle.height: 'tail'}.get(y, 'body')
+            shape    = SHAPES[xpos][ypos]
+            boldness = boldnesses.get((x, y), 'normal')
+            vertex   = VERTICES[shape][boldness]
+            row.append(vertex)
+        vertices.append(row)
+
+    for y in range(puzzle.height):
+        for x in range(puzzle.width):
+            vertex = vertices[y][x]
+            puzzle.main_grid.addstr(vertex)
+
+            square    = puzzle.get(x, y)
+            number    = square.number
+            attribute = curses.A_BOLD if number == puzzle.clue.number else curses.A_NORMAL
+            number    = '' if number is None else str(number)
+            puzzle.main_grid.addstr(number, attribute)
+
+            bold = boldnesses.get((x, y)) in ('topleft', 'bottomleft', 'horizontal')
+            edge = EDGES['horizontal'][bold] * (3 - len(number))
+            puzzle.main_grid.addstr(edge)
+
+        puzzle.main_grid.addstr(vertices[y][x + 1])
+
+        for x in range(puzzle.width):
+            bold = boldnesses.get((x, y)) in ('topleft', 'topright', 'vertical')
+            edge = EDGES['vertical'][bold]
+            puzzle.main_grid.addstr(edge)
+
+            square = puzzle.get(x, y)
+            if square.black:
+                puzzle.main_grid.addstr(SHADE * 3)
+            else:
+                cursor = '>' if (x, y) == (puzzle.x, puzzle.y) else ' '
+                puzzle.main_grid.addstr(cursor, curses.A_BOLD)
+
+                letter = ' ' if square.empty else square.buffer
+                status = square.status
+                puzzle.main_grid.addstr(letter + status)
+
+        bold = boldnesses.get((x + 1, y)) in ('topright', 'vertical')
+        edge = EDGES['vertical'][bold]
+        puzzle.main_grid.addstr(edge)
+
+    y = puzzle.height
+    for x in range(puzzle.width):
+        vertex = vertices[y][x]
+        bold   = boldnesses.get((x, y)) in ('bottomleft', 'horizontal')
+        edge   = EDGES['horizontal'][bold]
+        puzzle.main_grid.addstr(vertex + edge * 3)
+
+    vertex = vertices[y][x + 1]
+    puzzle.main_grid.addstr(vertex)
+
+    puzzle.main_grid.refresh()
+
+RENDERERS = (('per cell', render_per_cell),
+             ('batched',  Puzzle.render_main_grid))
+
+def bench(stdscr, size, frames):
+    curses.curs_set(0)
+    puzzle  = generate(size)
+    nrows   = size * 2 + 1
+    ncols   = size * 4 + 1
+    results = []
+
+    for name, render in RENDERERS:
+        puzzle.main_grid = window = CountingWindow()
+        render(puzzle)
+        calls = window.calls
+
+        puzzle.main_grid = curses.newwin(nrows + 1, ncols, 0, 0)
+        puzzle.first()
+        elapsed = 0
+        for _ in range(frames):
+            start = time.perf_counter()
+            render(puzzle)
+            elapsed += time.perf_counter() - start
+            puzzle.advance()
+
+        results.append((name, calls, elapsed / frames))
+
+    return results
+
+def main(size=21, frames=1000):
+    read_end, write_end = os.pipe()
+    pid, terminal = pty.fork()
+
+    if pid == 0:
+        os.close(read_end)
+        try:
+            window_size = struct.pack('HHHH', size * 2 + 2, size * 4 + 2, 0, 0)
+            fcntl.ioctl(sys.stdin.fileno(), termios.TIOCSWINSZ, window_size)
+            if os.environ.get('TERM', 'dumb') == 'dumb':
+                os.environ['TERM'] = 'xterm'
+            output = json.dumps(curses.wrapper(bench, size, frames))
+        except Exception:
+            output = json.dumps(traceback.format_exc())
+        os.write(write_end, output.encode())
+        os._exit(0)
+
+    os.close(write_end)
+    # Swallow whatever curses draws, so that it never blocks on a full pty;
+    # reading fails with EIO once the benchmark is done
+    try:
+        while os.read(terminal, 1 << 16):
+            pass
+    except OSError:
+        pass
+    os.waitpid(pid, 0)
+
+    with os.fdopen(read_end) as f:
+        results = json.load(f)
+    if isinstance(results, str):
+        sys.exit(results)
+
+    print(f'{size}x{size} grid:')
+    for name, calls, elapsed in results:
+        print(f'  {name:8}  {calls:6} curses calls per frame, '
+              f'{elapsed * 1e6:6.0f} µs per frame')
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
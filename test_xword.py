@@ -0,0 +1,303 @@
+import random
+from functools import partial
+
+import pytest
+
+import bench_render
+import xword
+from xword import (BLACK, DIRECTIONS, EMPTY, Clue, ClueIndex, GridAnalysis, Puzzle,
+                   Recorder, Replay)
+
+generate = partial(bench_render.generate, filled=False)
+
+def state(puzzle):
+    return ([(square.buffer, square.status) for square in puzzle.squares],
+            (puzzle.x, puzzle.y, puzzle.direction, puzzle.mode))
+
+def test_log_round_trip_at_largest_size(tmp_path):
+    # 255x255 is as big as the .puz format goes
+    log    = tmp_path / 'session.xwl'
+    puzzle = generate(255)
+
+    recorder = Recorder(puzzle, log)
+    for square in puzzle.squares:
+        if not square.black:
+            square.set('B')
+    recorder.record(['x'])
+    recorder.keyframe(recorder.now())
+    puzzle.square.unset()
+    recorder.record(['x'])
+    recorder.close()
+
+    replay = Replay(generate(255), log)
+    replay.seek(float('inf'))
+    assert state(replay.puzzle) == state(puzzle)
+
+class Window:
+    def __init__(self, keys):
+        self.keys = iter(keys)
+
+    def getkey(self):
+        return next(self.keys)
+
+def test_log_records_keys_read_while_handling(tmp_path):
+    log    = tmp_path / 'session.xwl'
+    puzzle = generate(5)
+    puzzle.main_grid = Window('A')
+
+    recorder = Recorder(puzzle, log)
+    puzzle.handle(puzzle.getkey(Window('r')))
+    recorder.record(puzzle.keys)
+    recorder.close()
+
+    replay = Replay(generate(5), log)
+    kind, _, payload = replay.records[-1]
+    assert replay.apply(kind, payload) == ['r', 'A']
+    assert state(replay.puzzle) == state(puzzle)
+
+def test_log_records_status_changes(tmp_path):
+    log    = tmp_path / 'session.xwl'
+    puzzle = generate(5)
+
+    recorder = Recorder(puzzle, log)
+    squares  = [square for square in puzzle.squares if not square.black]
+    squares[0].set('B', pencil=True)
+    squares[1].set('B')
+    recorder.record(['x'])
+    squares[0].erase()
+    squares[1].mark()
+    recorder.record(['x'])
+    squares[1].toggle_pencil()
+    recorder.record(['x'])
+    recorder.close()
+
+    replay = Replay(generate(5), log)
+    replay.seek(float('inf'))
+    assert state(replay.puzzle) == state(puzzle)
+
+def test_replay_rejects_log_without_keyframe(tmp_path):
+    log    = tmp_path / 'session.xwl'
+    puzzle = generate(5)
+
+    Recorder(puzzle, log).close()
+    log.write_bytes(log.read_bytes()[:-1])
+
+    with pytest.raises(AssertionError, match='keyframe'):
+        Replay(generate(5), log)
+
+def test_search_ignores_curses_key_names(monkeypatch):
+    monkeypatch.setattr('curses.curs_set', lambda visibility: None)
+    puzzle = generate(5)
+    puzzle.show_message      = lambda message: None
+    puzzle.render_main_grid  = lambda: None
+    puzzle.render_clue_grids = lambda: None
+    puzzle.status_line       = Window(['C', 'KEY_LEFT', 'l', 'KEY_RESIZE', '\n'])
+
+    puzzle.search()
+    assert puzzle.last_search == 'Cl'
+
+class StatusLine:
+    # Fails the way a curses window does when written past its last column
+    def __init__(self, width):
+        self.width = width
+
+    def getmaxyx(self):
+        return 1, self.width
+
+    def erase(self):
+        pass
+
+    def addstr(self, message):
+        assert len(message) < self.width, f'{message!r} is too long'
+        self.message = message
+
+    def refresh(self):
+        pass
+
+def test_replay_clips_long_search_to_status_line(tmp_path, monkeypatch):
+    monkeypatch.setattr('curses.curs_set', lambda visibility: None)
+    log    = tmp_path / 'session.xwl'
+    puzzle = generate(5)
+    puzzle.show_message      = lambda message: None
+    puzzle.render_main_grid  = lambda: None
+    puzzle.render_clue_grids = lambda: None
+    puzzle.status_line       = Window(list('cluesandmorecluesandmore') + ['\n'])
+
+    recorder = Recorder(puzzle, log)
+    puzzle.handle(puzzle.getkey(Window('/')))
+    recorder.record(puzzle.keys)
+    recorder.close()
+
+    replay = Replay(generate(5), log)
+    replay.puzzle.render_main_grid  = lambda: None
+    replay.puzzle.render_clue_grids = lambda: None
+    replay.puzzle.status_line       = StatusLine(21) # as wide as a 5x5 grid
+    for kind, timestamp, payload in replay.records:
+        replay.show(timestamp, replay.apply(kind, payload))
+    assert replay.puzzle.status_line.message.endswith("'e' '\\n'")
+
+def test_solving_carries_on_when_log_cannot_be_written(tmp_path):
+    puzzle = generate(5)
+    puzzle.status_line = StatusLine(21)
+
+    assert puzzle.record(tmp_path / 'missing' / 'session.xwl') is None
+    assert puzzle.status_line.message.startswith('Not recording')
+    puzzle.square.set('A') # nothing to report changes to
+
+def random_grid(width, height, seed):
+    rng    = random.Random(seed)
+    answer = [[BLACK if rng.random() < 0.2 else 'A' for x in range(width)]
+              for y in range(height)]
+    answer[0][0] = 'A' # so that there's at least one across clue
+    buffer = [[BLACK if letter == BLACK else rng.choice((EMPTY, 'A'))
+               for letter in row]
+              for row in answer]
+    return answer, buffer
+
+def structure(puzzle):
+    def position(square):
+        return None if square is None else tuple(square)
+
+    def clue(clue):
+        return None if clue is None else (clue.number, clue.text, clue.filled,
+                                          [position(square) for square in clue.span])
+
+    squares = [(square.number,
+                [clue(square.clues[direction]) for direction in DIRECTIONS],
+                [position(square.next[direction]) for direction in DIRECTIONS],
+                [position(square.prev[direction]) for direction in DIRECTIONS])
+               for square in puzzle.squares]
+    clues   = [(clue(c), clue(c.prev), clue(c.next))
+               for direction in DIRECTIONS for c in puzzle.clues[direction]]
+    return squares, clues
+
+@pytest.mark.parametrize('seed', range(50))
+def test_numpy_analysis_matches_python(monkeypatch, seed):
+    pytest.importorskip('numpy')
+    rng = random.Random(seed)
+    answer, buffer = random_grid(rng.randint(2, 30), rng.randint(1, 30), seed)
+
+    def build(threshold):
+        monkeypatch.setattr(xword, 'NUMPY_THRESHOLD', threshold)
+        cluelist = (f'Clue {i}' for i in range(len(answer) * len(answer[0]) * 2))
+        return Puzzle(answer, buffer, cluelist, '', '', '', [])
+
+    assert structure(build(0)) == structure(build(float('inf')))
+
+@pytest.mark.parametrize('seed', range(20))
+def test_toggles_match_fresh_analysis(seed):
+    numpy  = pytest.importorskip('numpy')
+    rng    = random.Random(seed)
+    answer, _ = random_grid(17, 13, seed)
+    analysis  = GridAnalysis([[letter == BLACK for letter in row] for row in answer])
+
+    for _ in range(30):
+        analysis.toggle(rng.randrange(17), rng.randrange(13))
+        fresh = GridAnalysis(analysis.black.copy())
+        assert numpy.array_equal(analysis.numbers, fresh.numbers)
+        for direction in DIRECTIONS:
+            assert numpy.array_equal(analysis.starts[direction],  fresh.starts[direction])
+            assert numpy.array_equal(analysis.lengths[direction], fresh.lengths[direction])
+            assert numpy.array_equal(analysis.next[direction],    fresh.next[direction])
+            assert numpy.array_equal(analysis.prev[direction],    fresh.prev[direction])
+
+def clue_index(*texts):
+    # One across clue per text, numbered from 1
+    clues = {'across': [Clue(number, text, []) for number, text in enumerate(texts, 1)],
+             'down':   []}
+    return ClueIndex(clues)
+
+def test_search_short_queries():
+    index = clue_index('Cat nap', 'Dog', 'Scat!')
+    assert index.search('c')   == ([0, 2], None)
+    assert index.search('at')  == ([0, 2], None)
+    assert index.search('dog') == ([1], None)
+    assert index.search('  ')  == ([], None)
+
+def test_search_filters_trigram_candidates():
+    # Both clues have every trigram of "cat nap", only one has it in a row
+    index = clue_index('Cat nap', 'Nap for a cat')
+    assert index.search('cat nap') == ([0], None)
+    assert index.search('nap for') == ([1], None)
+    assert index.search('zebra')   == ([], None)
+
+def test_search_folds_case_accents_and_punctuation():
+    index = clue_index('Café owner', 'CAFE-AU-LAIT')
+    assert index.search('cafe')     == ([0, 1], None)
+    assert index.search('Café')     == ([0, 1], None)
+    assert index.search('cafe au ') == ([1], None)
+
+def test_search_whole_words():
+    index = clue_index('Big cat', 'Scatter', 'Cat burglar')
+    assert index.search('cat')       == ([0, 1, 2], None)
+    assert index.search(' cat ')     == ([0, 2], None)
+    assert index.search(' cat burg') == ([2], None)
+
+def test_search_references():
+    index = clue_index('Opener', 'See 1-Across', '1-, 2- and 4-Across, together',
+                       'Follower of 1 and 2 Across', 'Part 1 of a quote')
+    assert index.search('1-Across') == ([0, 1, 2, 3], 0)
+    assert index.search('2a')       == ([1, 2, 3], 1)
+    assert index.search('4 across') == ([2, 3], 3)
+    # "Part 1 of" isn't a reference, so clue 5 is only found as itself
+    assert index.search('5a')       == ([4], 4)
+    assert index.search('9a')       == ([], None)
+
+def test_filled_counters_follow_square_changes():
+    puzzle = generate(5)
+    square = puzzle.square
+    across = square.clues['across']
+    down   = square.clues['down']
+
+    def counts():
+        return across.filled, down.filled
+
+    square.set('B')
+    assert counts() == (1, 1)
+    square.set('C', pencil=True) # already filled, so no change
+    assert counts() == (1, 1)
+    square.unset()
+    assert counts() == (0, 0)
+    square.unset()
+    assert counts() == (0, 0)
+    square.reveal()
+    assert counts() == (1, 1)
+    square.restore(EMPTY, ' ')
+    assert counts() == (0, 0)
+    square.restore('A', '?')
+    assert counts() == (1, 1)
+
+    for clue in (across, down):
+        for other in clue.span:
+            other.set('A')
+        assert clue.full
+        assert clue.filled == len(clue.span)
+
+def test_w_and_b_skip_filled_clues():
+    puzzle = generate(5)
+    puzzle.execute_command(b'set skipfilled')
+    across = puzzle.clues['across']
+    for square in across[1].span + across[2].span:
+        square.set('A')
+
+    puzzle.handle('w')
+    assert puzzle.clue is across[3]
+    puzzle.handle('b')
+    assert puzzle.clue is across[0]
+
+    puzzle.execute_command(b'set noskipfilled')
+    puzzle.handle('w')
+    assert puzzle.clue is across[1]
+
+def test_skipping_stops_where_it_started_when_everything_is_filled():
+    puzzle = generate(5)
+    puzzle.execute_command(b'set skipfilled')
+    for square in puzzle.squares:
+        if not square.black:
+            square.set('A')
+
+    start = puzzle.clue
+    puzzle.handle('w')
+    assert puzzle.clue is start
+    puzzle.handle('b')
+    assert puzzle.clue is start
@@ -1,12 +1,23 @@
+import argparse
 import curses
+import math
 import os
+import re
 import struct
 import sys
+import time
+import unicodedata
+from bisect      import bisect_left, bisect_right
 from collections import defaultdict
 from itertools   import chain, dropwhile, groupby
 from string      import ascii_uppercase, ascii_lowercase
 from textwrap    import TextWrapper
 
+try:
+    import numpy
+except ImportError: # only needed to analyze large grids faster
+    numpy = None
+
 ENCODING = 'iso-8859-1' # used by the .puz format
 
 BLACK = '.'
@@ -17,10 +28,19 @@ PENCIL = '?'
 CROSS  = 'x'
 
 DIRECTIONS = ('across', 'down')
+MODES      = ('normal', 'insert')
 
 UPPERCASE = set(ascii_uppercase)
 LOWERCASE = set(ascii_lowercase)
 
+# Anything that isn't a letter or a digit, as far as clue search is concerned
+NONWORD = re.compile(r'[^a-z0-9]+')
+
+# Searching for something like "17-Across" or "23d" jumps to that clue
+REFERENCE  = re.compile(r'(\d+)\s*-?\s*(a|across|d|down)')
+REFERENCES = {'a': 'across', 'across': 'across',
+              'd': 'down',   'down':   'down'}
+
 WRAPPER = TextWrapper(width             = 32,
                       initial_indent    = ' '*4,
                       subsequent_indent = ' '*4)
@@ -75,6 +95,24 @@ EDGES = {'horizontal': '─━',
 
 SHADE = '░'
 
+# Session logs start with the magic and the grid size, followed by records
+# made up of a header and a payload. Every payload starts with the cursor
+# state; key events then carry every key read while handling the first one
+# and the cells they changed, keyframes carry every cell so that replay can
+# seek without going back to the start.
+LOG_MAGIC  = b'XWL\x01'
+LOG_HEADER = struct.Struct('<BII')  # kind, milliseconds, payload length
+LOG_CURSOR = struct.Struct('<BBBB') # x, y, direction, mode
+LOG_DELTA  = struct.Struct('<Hcc')  # cell index, buffer, status
+
+KEY_EVENT = 0
+KEYFRAME  = 1
+
+KEYFRAME_INTERVAL = 30_000 # milliseconds
+
+# Below about 25x25, plain Python analyzes a grid faster than NumPy does
+NUMPY_THRESHOLD = 625
+
 class Puzzle:
     def __init__(self, answer, buffer, cluelist, title, author, copyright, notes):
         self.grid = [[Square(x, y, a, b)
@@ -84,11 +122,43 @@ class Puzzle:
         self.width  = len(self.grid[0])
         self.height = len(self.grid)
 
+        # The shape of a vertex only depends on where it is in the grid, so
+        # look the shapes and their normal glyphs up once; rendering then only
+        # has to swap in the few glyphs around the current clue
+        self.shapes = [[SHAPES[{0: 'head', self.width:  'tail'}.get(x, 'body')]
+                              [{0: 'head', self.height: 'tail'}.get(y, 'body')]
+                        for x in range(self.width + 1)]
+                       for y in range(self.height + 1)]
+        self.vertices = [[VERTICES[shape]['normal'] for shape in row] for row in self.shapes]
+
         self.title     = title
         self.author    = author
         self.copyright = copyright
         self.notes     = notes
 
+        if numpy is not None and self.width * self.height >= NUMPY_THRESHOLD:
+            self.analyze_numpy(cluelist)
+        else:
+            self.analyze(cluelist)
+
+        self.mode      = 'normal'
+        self.direction = 'across'
+
+        # Initialize the cursor position to the first square of the
+        # first across clue, which is not necessarily (0, 0), since
+        # there could be black squares in the top left-hand corner.
+        self.x, self.y = self.clues[self.direction][0].span[0]
+
+        self.last_find   = None
+        self.skip_filled = False # whether w and b skip clues that are filled in
+
+        self.clue_index  = ClueIndex(self.clues)
+        self.last_search = None
+        self.matches     = [] # positions in self.clue_index of clues matching the last search
+
+        self.keys = [] # keys read while handling the current one, for the session log
+
+    def analyze(self, cluelist):
         # Map squares that start clues to the squares the clues span
         spans = {direction: {} for direction in DIRECTIONS}
 
@@ -137,48 +207,133 @@ class Puzzle:
                         prev_square.next[direction] = square
                     prev_square = square
 
-        self.mode      = 'normal'
-        self.direction = 'across'
-
-        # Initialize the cursor position to the first square of the
-        # first across clue, which is not necessarily (0, 0), since
-        # there could be black squares in the top left-hand corner.
-        self.x, self.y = self.clues[self.direction][0].span[0]
-
-        self.last_find = None
+    def analyze_numpy(self, cluelist):
+        # Same as analyze(), but with the spans, numbers and links worked out
+        # in bulk by GridAnalysis. Squares and clues are then looked up for
+        # every square at once through object arrays that end in None, so
+        # that an index of -1 (no such square) looks up None.
+        squares  = list(self.squares)
+        size     = len(squares)
+        answers  = numpy.array([square.answer for square in squares])
+        buffers  = numpy.array([square.buffer for square in squares])
+        black    = answers == BLACK
+        analysis = GridAnalysis(black.reshape(self.height, self.width))
+        numbers  = analysis.numbers.ravel().tolist()
+        lengths  = {direction: analysis.lengths[direction].ravel().tolist()
+                    for direction in DIRECTIONS}
+        owners   = {direction: analysis.owners(direction) for direction in DIRECTIONS}
+
+        # Count the filled squares of every clue in one go too
+        filled = ~black & (buffers != EMPTY)
+        filled = {direction: numpy.bincount(owners[direction][filled], minlength=size).tolist()
+                  for direction in DIRECTIONS}
+
+        cluelist = iter(cluelist)
+        self.clues = {direction: [] for direction in DIRECTIONS}
 
-    def run(self):
+        square_array = numpy.fromiter(chain(squares, [None]), dtype=object, count=size + 1)
+        clue_arrays  = {direction: numpy.full(size + 1, None, dtype=object)
+                        for direction in DIRECTIONS}
+
+        for direction, index in analysis.clue_order():
+            number = numbers[index]
+            length = lengths[direction][index]
+            step   = 1 if direction == 'across' else self.width
+            span   = squares[index:index + length*step:step]
+            clue   = Clue(number, next(cluelist), span, filled[direction][index])
+            self.clues[direction].append(clue)
+            squares[index].number = number
+            clue_arrays[direction][index] = clue
+
+        for clues in self.clues.values():
+            for prev_clue, clue in zip(clues, clues[1:]):
+                clue.prev = prev_clue
+                prev_clue.next = clue
+
+        clues = {direction: clue_arrays[direction][owners[direction]].tolist()
+                 for direction in DIRECTIONS}
+        nexts = {direction: square_array[analysis.next[direction]].tolist()
+                 for direction in DIRECTIONS}
+        prevs = {direction: square_array[analysis.prev[direction]].tolist()
+                 for direction in DIRECTIONS}
+
+        for square, across_clue, down_clue, next_across, next_down, prev_across, prev_down in zip(
+                squares, clues['across'], clues['down'],
+                nexts['across'], nexts['down'], prevs['across'], prevs['down']):
+            square_clues = square.clues
+            square_clues['across'] = across_clue
+            square_clues['down']   = down_clue
+            square_next = square.next
+            square_next['across'] = next_across
+            square_next['down']   = next_down
+            square_prev = square.prev
+            square_prev['across'] = prev_across
+            square_prev['down']   = prev_down
+
+    def run(self, log=None):
         # Prevent escape key delay
         os.environ.setdefault('ESCDELAY', '0')
 
         def main(stdscr):
-            # Don't force white text on black
-            curses.use_default_colors()
-            # Hide cursor
-            curses.curs_set(0)
-            # Compute size of puzzle grid
-            nrows = self.height * 2 + 1 # or, in curses lingo, `nlines`
-            ncols = self.width  * 4 + 1
-            # Draw static stuff
-            stdscr.addstr(0, 0, self.title, curses.A_BOLD)
-            stdscr.addstr(1, 0, self.author)
-            stdscr.addstr(3, ncols + 2,  'Across', curses.A_BOLD)
-            stdscr.addstr(3, ncols + 36, 'Down',   curses.A_BOLD)
-            stdscr.refresh()
-            # As a bit of an ugly hack to get around the curses quirk of not
-            # allowing writing at the bottom right corner, add an extra line
-            # at the bottom of windows that can be filled to the brim
-            self.main_grid   = curses.newwin(nrows + 1, ncols, 3, 0)
-            self.status_line = curses.newwin(1, ncols, nrows + 4, 0)
-            self.clue_grids  = {'across': curses.newwin(nrows, 33, 4, ncols + 2),
-                                'down':   curses.newwin(nrows, 33, 4, ncols + 36)}
-            while True:
-                self.render_main_grid()
-                self.render_clue_grids()
-                self.handle(stdscr.getkey())
+            self.setup(stdscr)
+            recorder = self.record(log) if log is not None else None
+            try:
+                while True:
+                    self.render_main_grid()
+                    self.render_clue_grids()
+                    self.handle(self.getkey(stdscr))
+                    if recorder is not None:
+                        recorder.record(self.keys)
+                    self.keys = []
+            finally:
+                # :q exits from inside handle(), so record the keys that got
+                # us there and make sure everything hits the disk
+                if recorder is not None:
+                    if self.keys:
+                        recorder.record(self.keys)
+                    recorder.close()
 
         curses.wrapper(main)
 
+    def record(self, log):
+        # Solving doesn't need write access, so if the log can't be
+        # written, say so and carry on without one
+        try:
+            return Recorder(self, log)
+        except OSError as error:
+            width = self.status_line.getmaxyx()[1] - 1
+            self.show_message(f'Not recording: {error.strerror}'[:width])
+            return None
+
+    def getkey(self, window):
+        # All keys are read through here, including the ones read halfway
+        # through handling another key (like the letter after r or f)
+        key = window.getkey()
+        self.keys.append(key)
+        return key
+
+    def setup(self, stdscr):
+        # Don't force white text on black
+        curses.use_default_colors()
+        # Hide cursor
+        curses.curs_set(0)
+        # Compute size of puzzle grid
+        nrows = self.height * 2 + 1 # or, in curses lingo, `nlines`
+        ncols = self.width  * 4 + 1
+        # Draw static stuff
+        stdscr.addstr(0, 0, self.title, curses.A_BOLD)
+        stdscr.addstr(1, 0, self.author)
+        stdscr.addstr(3, ncols + 2,  'Across', curses.A_BOLD)
+        stdscr.addstr(3, ncols + 36, 'Down',   curses.A_BOLD)
+        stdscr.refresh()
+        # As a bit of an ugly hack to get around the curses quirk of not
+        # allowing writing at the bottom right corner, add an extra line
+        # at the bottom of windows that can be filled to the brim
+        self.main_grid   = curses.newwin(nrows + 1, ncols, 3, 0)
+        self.status_line = curses.newwin(1, ncols, nrows + 4, 0)
+        self.clue_grids  = {'across': curses.newwin(nrows, 33, 4, ncols + 2),
+                            'down':   curses.newwin(nrows, 33, 4, ncols + 36)}
+
     def render_main_grid(self):
         self.main_grid.erase()
 
@@ -205,65 +360,66 @@ class Puzzle:
             boldnesses[(x,     y + 1)] = 'bottomleft'
             boldnesses[(x + 1, y + 1)] = 'bottomright'
 
-        vertices = []
-        for y in range(self.height + 1):
-            row = []
-            for x in range(self.width + 1):
-                xpos     = {0: 'head', self.width:  'tail'}.get(x, 'body')
-                ypos     = {0: 'head', self.height: 'tail'}.get(y, 'body')
-                shape    = SHAPES[xpos][ypos]
-                boldness = boldnesses.get((x, y), 'normal')
-                vertex   = VERTICES[shape][boldness]
-                row.append(vertex)
-            vertices.append(row)
-
-        for y in range(self.height):
-            for x in range(self.width):
+        vertices = [row.copy() for row in self.vertices]
+        for (x, y), boldness in boldnesses.items():
+            vertices[y][x] = VERTICES[self.shapes[y][x]][boldness]
+
+        # Every row is exactly as wide as the window, so the rows simply
+        # wrap into each other and the whole grid can be drawn as one frame
+        frame       = Frame()
+        clue_number = self.clue.number
+        cursor      = self.square
+
+        for y, row in enumerate(self.grid):
+            for x, square in enumerate(row):
                 vertex = vertices[y][x]
-                self.main_grid.addstr(vertex)
+                frame.add(vertex)
 
-                square    = self.get(x, y)
                 number    = square.number
-                attribute = curses.A_BOLD if number == self.clue.number else curses.A_NORMAL
+                attribute = curses.A_BOLD if number == clue_number else curses.A_NORMAL
                 number    = '' if number is None else str(number)
-                self.main_grid.addstr(number, attribute)
+                frame.add(number, attribute)
 
                 bold = boldnesses.get((x, y)) in ('topleft', 'bottomleft', 'horizontal')
                 edge = EDGES['horizontal'][bold] * (3 - len(number))
-                self.main_grid.addstr(edge)
+                frame.add(edge)
 
-            self.main_grid.addstr(vertices[y][x + 1])
+            frame.add(vertices[y][x + 1])
 
-            for x in range(self.width):
+            for x, square in enumerate(row):
                 bold = boldnesses.get((x, y)) in ('topleft', 'topright', 'vertical')
                 edge = EDGES['vertical'][bold]
-                self.main_grid.addstr(edge)
+                frame.add(edge)
 
-                square = self.get(x, y)
                 if square.black:
-                    self.main_grid.addstr(SHADE * 3)
+                    frame.add(SHADE * 3)
                 else:
-                    cursor = '>' if (x, y) == (self.x, self.y) else ' '
-                    self.main_grid.addstr(cursor, curses.A_BOLD)
+                    # Only the cursor itself is bold; a bold space would look
+                    # the same but would break up the run for nothing
+                    if square is cursor:
+                        frame.add('>', curses.A_BOLD)
+                    else:
+                        frame.add(' ')
 
                     letter = ' ' if square.empty else square.buffer
                     status = square.status
-                    self.main_grid.addstr(letter + status)
+                    frame.add(letter + status)
 
             bold = boldnesses.get((x + 1, y)) in ('topright', 'vertical')
             edge = EDGES['vertical'][bold]
-            self.main_grid.addstr(edge)
+            frame.add(edge)
 
         y = self.height
         for x in range(self.width):
             vertex = vertices[y][x]
             bold   = boldnesses.get((x, y)) in ('bottomleft', 'horizontal')
             edge   = EDGES['horizontal'][bold]
-            self.main_grid.addstr(vertex + edge * 3)
+            frame.add(vertex + edge * 3)
 
         vertex = vertices[y][x + 1]
-        self.main_grid.addstr(vertex)
+        frame.add(vertex)
 
+        frame.draw(self.main_grid)
         self.main_grid.refresh()
 
     def render_clue_grids(self):
@@ -276,11 +432,16 @@ class Puzzle:
             heights = []
 
             active_clue = self.square.clues[direction]
+            matches     = {self.clue_index.clues[position][1] for position in self.matches}
 
             for index, clue in enumerate(self.clues[direction]):
                 active    = clue is active_clue
                 render    = clue.render(active)
                 attribute = curses.A_BOLD if clue is self.clue else curses.A_NORMAL
+                if clue in matches:
+                    attribute |= curses.A_UNDERLINE
+                if clue.full:
+                    attribute |= curses.A_DIM
                 lines.extend((line, attribute) for line in render)
                 heights.append(len(render))
                 if active:
@@ -319,19 +480,19 @@ class Puzzle:
                 elif key == '$':
                     self.end()
                 elif key == 'g':
-                    next_key = self.main_grid.getkey()
+                    next_key = self.getkey(self.main_grid)
                     if next_key == 'g':
                         self.first()
                 elif key == 'G':
                     self.last()
                 elif key == 'w':
-                    self.next()
+                    self.next(skip_filled=self.skip_filled)
                 elif key == 'b':
-                    self.prev()
+                    self.prev(skip_filled=self.skip_filled)
                 elif key in 'fFtT;,':
                     skip_one = False # see explanation below
                     if key in 'fFtT':
-                        letter  = self.main_grid.getkey().upper()
+                        letter  = self.getkey(self.main_grid).upper()
                         forward = key in 'ft'
                         till    = key in 'tT'
                         self.last_find = (letter, forward, till)
@@ -376,7 +537,7 @@ class Puzzle:
                               forward=forward, skip_repeats=True)
                 elif key in '][':
                     forward  = key == ']'
-                    next_key = self.main_grid.getkey()
+                    next_key = self.getkey(self.main_grid)
                     status   = {'q': PENCIL, 'w': CROSS}.get(next_key)
                     if status is not None:
                         self.find(lambda square: square.status == status,
@@ -396,12 +557,16 @@ class Puzzle:
                     self.toggle_pencil()
                 elif key == ':':
                     self.type_command()
+                elif key == '/':
+                    self.search()
+                elif key in 'nN':
+                    self.search_next(forward=key == 'n')
             # Keys specific to insert mode
             else:
                 if key == '\x1b':
                     self.escape()
                 elif key == 'j':
-                    next_key = self.main_grid.getkey()
+                    next_key = self.getkey(self.main_grid)
                     if next_key == 'k':
                         self.escape()
                     else:
@@ -456,6 +621,11 @@ class Puzzle:
     def other_direction(self):
         return 'down' if self.direction == 'across' else 'across'
 
+    @property
+    def squares(self):
+        for row in self.grid:
+            yield from row
+
     def in_range(self, x, y):
         return 0 <= x < self.width and 0 <= y < self.height
 
@@ -494,19 +664,28 @@ class Puzzle:
     def last(self):
         self.jump(self.clues[self.direction][-1].span[0])
 
-    def next(self):
-        if self.next_clue is not None:
-            self.jump(self.next_clue.span[0])
-        else:
-            self.toggle()
-            self.first()
+    def next(self, skip_filled=False):
+        clue = self.clue
+        while True:
+            if self.next_clue is not None:
+                self.jump(self.next_clue.span[0])
+            else:
+                self.toggle()
+                self.first()
+            # Stop when back where we started, in case everything is filled
+            if not (skip_filled and self.clue.full) or self.clue is clue:
+                break
 
-    def prev(self):
-        if self.prev_clue is not None:
-            self.jump(self.prev_clue.span[0])
-        else:
-            self.toggle()
-            self.last()
+    def prev(self, skip_filled=False):
+        clue = self.clue
+        while True:
+            if self.prev_clue is not None:
+                self.jump(self.prev_clue.span[0])
+            else:
+                self.toggle()
+                self.last()
+            if not (skip_filled and self.clue.full) or self.clue is clue:
+                break
 
     def find(self, condition, forward=True, skip_repeats=False, skip_one=False):
         assert not (skip_repeats and skip_one) # makes no sense to set both options
@@ -554,7 +733,7 @@ class Puzzle:
             self.end()
 
     def replace(self):
-        key = self.main_grid.getkey()
+        key = self.getkey(self.main_grid)
         self.type(key)
 
     def type(self, key):
@@ -590,6 +769,78 @@ class Puzzle:
             self.square.toggle_pencil()
         self.advance()
 
+    def jump_to_clue(self, position):
+        self.direction, clue = self.clue_index.clues[position]
+        self.jump(clue.span[0])
+
+    def search(self):
+        origin_square    = self.square
+        origin_direction = self.direction
+        last_search      = self.last_search
+        pattern          = ''
+
+        curses.curs_set(1) # show cursor
+
+        # Search as you type: every key starts over from where
+        # the cursor was when / was pressed, like 'incsearch' in Vim
+        while True:
+            self.show_message('/' + pattern)
+            key = self.getkey(self.status_line)
+            if key == '\n':
+                if pattern:
+                    if not self.matches:
+                        self.show_message(f'Pattern not found: {pattern}')
+                else: # an empty pattern repeats the last search
+                    self.set_search(last_search)
+                    self.search_next()
+                break
+            if key == '\x1b':
+                self.jump(origin_square)
+                self.direction = origin_direction
+                self.set_search(last_search)
+                self.show_message('')
+                break
+            if key in ('\x7f', '\b', 'KEY_BACKSPACE'):
+                pattern = pattern[:-1]
+            elif len(key) > 1: # other curses key names, like KEY_LEFT
+                continue
+            else:
+                pattern += key
+            self.jump(origin_square)
+            self.direction = origin_direction
+            target = self.set_search(pattern)
+            if target is not None:
+                self.jump_to_clue(target)
+            elif self.matches:
+                self.search_next()
+            self.render_main_grid()
+            self.render_clue_grids()
+
+        curses.curs_set(0)
+
+    def set_search(self, pattern):
+        # Returns the position of the clue a cross-reference
+        # points to, if the pattern turns out to be one
+        self.last_search = pattern
+        if not pattern:
+            self.matches = []
+            return None
+        self.matches, target = self.clue_index.search(pattern)
+        return target
+
+    def search_next(self, forward=True):
+        if not self.matches:
+            if self.last_search:
+                self.show_message(f'Pattern not found: {self.last_search}')
+            return False
+        position = self.clue_index.positions[self.clue]
+        if forward:
+            index = bisect_right(self.matches, position) % len(self.matches)
+        else:
+            index = bisect_left(self.matches, position) - 1 # -1 wraps around
+        self.jump_to_clue(self.matches[index])
+        return True
+
     def type_command(self):
         curses.echo()      # show characters typed
         curses.curs_set(1) # show cursor
@@ -597,6 +848,7 @@ class Puzzle:
         self.status_line.erase()
         self.status_line.addstr(':')
         command = self.status_line.getstr(0, 1)
+        self.keys.append(command.decode() + '\n')
         self.execute_command(command)
 
         curses.noecho()
@@ -611,6 +863,10 @@ class Puzzle:
             self.check()
         elif command in ('c!', 'check!'):
             self.check(bang=True)
+        elif command == 'set skipfilled':
+            self.skip_filled = True
+        elif command == 'set noskipfilled':
+            self.skip_filled = False
         elif command: # not entirely whitespace
             self.show_message(f'Unknown command "{command}"')
 
@@ -668,13 +924,375 @@ class Puzzle:
     def quit(self):
         sys.exit()
 
+class GridAnalysis:
+    # Finds spans, numbers squares and links them up a whole grid at a time.
+    # Squares are referred to by their row-major indices, and -1 means none.
+    def __init__(self, black):
+        self.black = numpy.array(black, dtype=bool)
+        self.height, self.width = self.black.shape
+
+        self.starts  = {}
+        self.lengths = {}
+        for direction, black in zip(DIRECTIONS, (self.black, self.black.T)):
+            starts, lengths = find_spans(black)
+            if direction == 'down':
+                starts, lengths = starts.T.copy(), lengths.T.copy()
+            self.starts[direction]  = starts
+            self.lengths[direction] = lengths
+
+        # Running count of numbered squares, so that renumbering after a
+        # toggle can pick up the count where the toggled square is
+        numbered     = self.starts['across'] | self.starts['down']
+        self.counts  = numpy.cumsum(numbered.ravel())
+        self.numbers = numpy.where(numbered, self.counts.reshape(numbered.shape), 0)
+
+        self.links = None # (next, prev), worked out when first needed
+
+    @property
+    def next(self):
+        return self.link()[0]
+
+    @property
+    def prev(self):
+        return self.link()[1]
+
+    def link(self):
+        if self.links is not None:
+            return self.links
+
+        # Across, squares follow each other in reading order. Down, they're
+        # ordered by the clue they're in (clues are numbered in reading order
+        # too, so the index of the clue's first square will do), then by row.
+        next_indices = {}
+        prev_indices = {}
+
+        white  = numpy.flatnonzero(~self.black)
+        owners = self.owners('down')
+        orders = {'across': white,
+                  'down':   white[numpy.lexsort((white, owners[white]))]}
+
+        for direction, order in orders.items():
+            next_indices[direction] = numpy.full(self.height * self.width, -1)
+            prev_indices[direction] = numpy.full(self.height * self.width, -1)
+            next_indices[direction][order[:-1]] = order[1:]
+            prev_indices[direction][order[1:]]  = order[:-1]
+
+        self.links = (next_indices, prev_indices)
+        return self.links
+
+    def owners(self, direction):
+        # The index of the first square of the span each square is in
+        indices = numpy.arange(self.height * self.width).reshape(self.black.shape)
+        axis    = 1 if direction == 'across' else 0
+        owners  = numpy.where(self.starts[direction], indices, -1)
+        owners  = numpy.maximum.accumulate(owners, axis=axis)
+        return numpy.where(self.black, -1, owners).ravel()
+
+    def clue_order(self):
+        # Yields (direction, index) for every clue in the order the .puz
+        # format lists them: by first square, across before down
+        across = numpy.flatnonzero(self.starts['across'])
+        down   = numpy.flatnonzero(self.starts['down'])
+        keys   = numpy.concatenate((across * 2, down * 2 + 1))
+        for key in numpy.sort(keys).tolist():
+            yield DIRECTIONS[key % 2], key // 2
+
+    def toggle(self, x, y):
+        # Turns a square black or white and redoes only what can have changed:
+        # the spans in its row and column, and the numbers from it onwards
+        self.black[y, x] = not self.black[y, x]
+
+        starts, lengths = find_spans(self.black[y:y+1])
+        self.starts['across'][y]  = starts[0]
+        self.lengths['across'][y] = lengths[0]
+
+        starts, lengths = find_spans(self.black.T[x:x+1])
+        self.starts['down'][:, x]  = starts[0]
+        self.lengths['down'][:, x] = lengths[0]
+
+        index    = y * self.width + x
+        numbered = (self.starts['across'].ravel()[index:] |
+                    self.starts['down'].ravel()[index:])
+        base     = self.counts[index - 1] if index else 0
+        self.counts[index:] = base + numpy.cumsum(numbered)
+        self.numbers.ravel()[index:] = numpy.where(numbered, self.counts[index:], 0)
+
+        # Toggling a square can reorder the down clues all the way down the
+        # grid, so the links are redone in bulk, but only if they're asked for
+        self.links = None
+
+class Frame:
+    # Collects text into runs of the same attribute, so that
+    # drawing it takes one call into curses per attribute change
+    def __init__(self):
+        self.runs = [] # (pieces of text, attribute)
+
+    def add(self, text, attribute=curses.A_NORMAL):
+        if self.runs and self.runs[-1][1] == attribute:
+            self.runs[-1][0].append(text)
+        else:
+            self.runs.append(([text], attribute))
+
+    def draw(self, window):
+        for pieces, attribute in self.runs:
+            window.addstr(''.join(pieces), attribute)
+
+class Recorder:
+    def __init__(self, puzzle, filename):
+        self.puzzle = puzzle
+        self.file   = open(filename, 'wb')
+        self.start  = time.monotonic()
+        self.file.write(LOG_MAGIC + struct.pack('<BB', puzzle.width, puzzle.height))
+        self.keyframe(0)
+        # Squares report their own changes, so that recording a key
+        # only costs as much as the number of squares it changed
+        self.touched = set()
+        for square in puzzle.squares:
+            square.recorder = self
+
+    def now(self):
+        return int((time.monotonic() - self.start) * 1000)
+
+    def cursor(self):
+        puzzle = self.puzzle
+        return LOG_CURSOR.pack(puzzle.x, puzzle.y,
+                               DIRECTIONS.index(puzzle.direction),
+                               MODES.index(puzzle.mode))
+
+    def write(self, kind, timestamp, payload):
+        self.file.write(LOG_HEADER.pack(kind, timestamp, len(payload)) + payload)
+        # Flush every record so that a log is still useful
+        # when the session it comes from ends in a crash
+        self.file.flush()
+
+    def record(self, keys):
+        now    = self.now()
+        width  = self.puzzle.width
+        deltas = [LOG_DELTA.pack(square.y * width + square.x,
+                                 square.buffer.encode(ENCODING),
+                                 square.status.encode(ENCODING))
+                  for square in self.touched]
+        self.touched.clear()
+
+        keys    = [key.encode() for key in keys]
+        payload = b''.join([self.cursor(),
+                            struct.pack('<H', len(keys)),
+                            *(struct.pack('<H', len(key)) + key for key in keys),
+                            struct.pack('<H', len(deltas)), *deltas])
+        self.write(KEY_EVENT, now, payload)
+
+        if now - self.last_keyframe >= KEYFRAME_INTERVAL:
+            self.keyframe(now)
+
+    def keyframe(self, now):
+        buffers  = ''.join(square.buffer for square in self.puzzle.squares).encode(ENCODING)
+        statuses = ''.join(square.status for square in self.puzzle.squares).encode(ENCODING)
+        self.write(KEYFRAME, now, self.cursor() + buffers + statuses)
+        self.last_keyframe = now
+
+    def close(self):
+        self.file.close()
+
+class Replay:
+    def __init__(self, puzzle, filename):
+        self.puzzle  = puzzle
+        self.squares = list(puzzle.squares)
+
+        with open(filename, 'rb') as f:
+            data = f.read()
+
+        assert data.startswith(LOG_MAGIC), f'{filename} is not a session log'
+        size = struct.unpack_from('<BB', data, len(LOG_MAGIC))
+        assert size == (puzzle.width, puzzle.height), f'{filename} was recorded on another puzzle'
+
+        # Only read the record headers here; payloads are decoded as they're
+        # played, and seeking skips straight to the last keyframe before the
+        # target timestamp, so most of them never have to be looked at at all
+        self.records   = [] # (kind, timestamp, payload)
+        self.keyframes = [] # indices into self.records
+        offset = len(LOG_MAGIC) + 2
+        while offset + LOG_HEADER.size <= len(data):
+            kind, timestamp, length = LOG_HEADER.unpack_from(data, offset)
+            offset += LOG_HEADER.size
+            if offset + length > len(data):
+                break # the session was cut short mid-write
+            if kind == KEYFRAME:
+                self.keyframes.append(len(self.records))
+            self.records.append((kind, timestamp, data[offset:offset+length]))
+            offset += length
+
+        assert self.keyframes, f'{filename} ends before its first keyframe'
+        self.keyframe_times = [self.records[index][1] for index in self.keyframes]
+
+    def apply(self, kind, payload):
+        puzzle = self.puzzle
+        x, y, direction, mode = LOG_CURSOR.unpack_from(payload)
+        puzzle.x, puzzle.y = x, y
+        puzzle.direction   = DIRECTIONS[direction]
+        puzzle.mode        = MODES[mode]
+        offset = LOG_CURSOR.size
+
+        if kind == KEYFRAME:
+            n        = len(self.squares)
+            buffers  = payload[offset  :offset+n  ].decode(ENCODING)
+            statuses = payload[offset+n:offset+n*2].decode(ENCODING)
+            for square, buffer, status in zip(self.squares, buffers, statuses):
+                square.restore(buffer, status)
+            return [] # no keys were read
+
+        nkeys, = struct.unpack_from('<H', payload, offset)
+        offset += 2
+        keys   = []
+        for _ in range(nkeys):
+            length, = struct.unpack_from('<H', payload, offset)
+            keys.append(payload[offset+2:offset+2+length].decode())
+            offset += 2 + length
+        ndeltas, = struct.unpack_from('<H', payload, offset)
+        offset += 2
+        deltas  = payload[offset:offset+ndeltas*LOG_DELTA.size]
+        for index, buffer, status in LOG_DELTA.iter_unpack(deltas):
+            self.squares[index].restore(buffer.decode(ENCODING), status.decode(ENCODING))
+        return keys
+
+    def seek(self, timestamp):
+        # Returns the index of the first record after the given timestamp
+        # (in milliseconds), having applied everything up to it
+        position = bisect_right(self.keyframe_times, timestamp)
+        start    = self.keyframes[max(position - 1, 0)]
+        index    = start
+        while index < len(self.records):
+            kind, record_time, payload = self.records[index]
+            if index > start and record_time > timestamp:
+                break
+            self.apply(kind, payload)
+            index += 1
+        return index
+
+    def show(self, timestamp, keys=()):
+        puzzle = self.puzzle
+        minutes, seconds = divmod(timestamp // 1000, 60)
+        clock = f'{minutes:02}:{seconds:02}'
+
+        # A whole / search or : command makes up a single record, so only
+        # keep as many of its last keys as fit in the status line (curses
+        # refuses to write into the last column of the window)
+        width   = puzzle.status_line.getmaxyx()[1] - 1
+        keys    = list(map(repr, keys))
+        message = ' '.join([clock, *keys])
+        while len(message) > width and keys:
+            keys.pop(0)
+            message = ' '.join([clock, '…', *keys])
+
+        puzzle.render_main_grid()
+        puzzle.render_clue_grids()
+        puzzle.show_message(message[:width])
+
+    def play(self, speed=1.0, seek=0.0):
+        puzzle = self.puzzle
+
+        def main(stdscr):
+            puzzle.setup(stdscr)
+            index = self.seek(int(seek * 1000))
+            clock = self.records[index - 1][1]
+            self.show(clock)
+            for kind, timestamp, payload in self.records[index:]:
+                # Wait for the next record, but let q cut the replay short;
+                # any other key is ignored, and waiting carries on
+                deadline = time.monotonic() + (timestamp - clock) / speed / 1000
+                while (remaining := deadline - time.monotonic()) > 0:
+                    stdscr.timeout(math.ceil(remaining * 1000))
+                    if stdscr.getch() == ord('q'):
+                        return
+                clock = timestamp
+                self.show(timestamp, self.apply(kind, payload))
+            stdscr.timeout(-1)
+            stdscr.getch()
+
+        curses.wrapper(main)
+
+class ClueIndex:
+    def __init__(self, clues):
+        # Clues are searched in the order they're listed in the clue panes,
+        # and are referred to by their positions in that order
+        self.clues     = [(direction, clue) for direction in DIRECTIONS for clue in clues[direction]]
+        self.positions = {clue: position for position, (_, clue) in enumerate(self.clues)}
+        self.numbers   = {(clue.number, direction): position
+                          for position, (direction, clue) in enumerate(self.clues)}
+
+        # Pad with spaces so that a query like " cat " only matches whole words
+        self.texts = [normalize(f' {clue.text} ') for _, clue in self.clues]
+
+        # Clue text never changes after parsing, so index it all up front:
+        # every substring of up to three characters and every whole word maps
+        # to the clues that contain it, and every cross-reference like
+        # "See 17-Across" or "17-, 23- and 49-Across" maps to the clues that
+        # make it
+        self.grams      = defaultdict(set)
+        self.tokens     = defaultdict(set)
+        self.references = defaultdict(set)
+
+        for position, text in enumerate(self.texts):
+            for n in range(1, 4):
+                for i in range(len(text) - n + 1):
+                    self.grams[text[i:i+n]].add(position)
+
+            numbers = [] # waiting for the direction they refer to
+            for token in text.split():
+                self.tokens[token].add(position)
+                if token.isdigit():
+                    numbers.append(int(token))
+                elif token in DIRECTIONS:
+                    for number in numbers:
+                        self.references[(number, token)].add(position)
+                    numbers = []
+                elif token != 'and':
+                    numbers = []
+
+    def search(self, pattern):
+        # Returns the sorted positions of the matching clues,
+        # plus the position of the referenced clue if any
+        match = REFERENCE.fullmatch(pattern.strip().lower())
+        if match is not None:
+            key    = (int(match[1]), REFERENCES[match[2]])
+            target = self.numbers.get(key)
+            if target is not None:
+                return sorted(self.references[key] | {target}), target
+
+        query = normalize(pattern)
+        if not query.strip():
+            return [], None
+
+        # Only clues that contain every trigram of the query can contain the
+        # query itself (shorter queries are looked up whole), and words with
+        # spaces on both sides of them in the query can only match whole
+        # words. Start from the rarest of them to keep the sets small.
+        if len(query) <= 3:
+            postings = [self.grams.get(query, set())]
+        else:
+            postings = [self.grams.get(query[i:i+3], set()) for i in range(len(query) - 2)]
+        words     = [word for word in query.split(' ')[1:-1] if word]
+        postings += [self.tokens.get(word, set()) for word in words]
+        postings.sort(key=len)
+
+        candidates = set.intersection(*postings)
+        return sorted(position for position in candidates if query in self.texts[position]), None
+
 class Clue:
-    def __init__(self, number, text, span):
+    def __init__(self, number, text, span, filled=None):
         self.number = number
         self.text   = text
         self.span   = span
         self.prev   = None
         self.next   = None
+        # Kept up to date by the squares as they're filled in and emptied,
+        # so that nothing has to go through the span to know if it's full
+        if filled is None:
+            filled = sum(not square.empty for square in span)
+        self.filled = filled
+
+    @property
+    def full(self):
+        return self.filled == len(self.span)
 
     def render(self, active):
         lines    = WRAPPER.wrap(self.text)
@@ -693,6 +1311,7 @@ class Square:
         self.clues  = {direction: None for direction in DIRECTIONS}
         self.prev   = {direction: None for direction in DIRECTIONS}
         self.next   = {direction: None for direction in DIRECTIONS}
+        self.recorder = None # the Recorder logging this square's changes, if any
 
     def __iter__(self):
         yield self.x
@@ -711,11 +1330,17 @@ class Square:
         return not self.empty and self.buffer != self.answer
 
     def set(self, letter, pencil=False):
+        if (letter == EMPTY) != self.empty:
+            change = 1 if self.empty else -1
+            for clue in self.clues.values():
+                if clue is not None:
+                    clue.filled += change
         self.buffer = letter
         # When setting a square to a new letter (even when the new letter
         # is the same as the old one), overwrite any pencil or cross status,
         # unless you're pencilling in, in which case set the status to pencil
         self.status = PENCIL if pencil else NORMAL
+        self.touch()
 
     def unset(self):
         self.set(EMPTY)
@@ -725,18 +1350,50 @@ class Square:
         # pencil -> normal (of course)
         # cross  -> pencil (non-obvious but feels right to the user)
         self.status = NORMAL if self.status == PENCIL else PENCIL
+        self.touch()
 
     def erase(self):
         if self.status == PENCIL:
             self.status = NORMAL
+            self.touch()
 
     def mark(self):
         if self.wrong:
             self.status = CROSS
+            self.touch()
 
     def reveal(self):
         self.set(self.answer)
 
+    def restore(self, buffer, status):
+        self.set(buffer)
+        self.status = status
+
+    def touch(self):
+        if self.recorder is not None:
+            self.recorder.touched.add(self)
+
+def find_spans(black):
+    # Given rows of black squares, returns which squares start spans going
+    # along the rows, and the lengths of those spans (0 for other squares)
+    white  = ~black
+    starts = white.copy()
+    starts[:, 1:] &= black[:, :-1]
+    ends   = white.copy()
+    ends[:, :-1] &= black[:, 1:]
+
+    # Starts and ends pair up one to one in reading order
+    lengths       = numpy.zeros(black.shape, dtype=int)
+    start_indices = numpy.flatnonzero(starts)
+    lengths.flat[start_indices] = numpy.flatnonzero(ends) - start_indices + 1
+    return starts, lengths
+
+def normalize(text):
+    # Lowercase, strip accents and squash everything else into single spaces
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return NONWORD.sub(' ', text)
+
 def parse(filename):
     with open(filename, 'rb') as f:
         f.seek(0x2c) # skip checksums, file magic, etc. for now
@@ -753,6 +1410,32 @@ def parse(filename):
         assert len(cluelist) == nclues, f'Expected {nclues} clues, got {len(cluelist)}'
         return Puzzle(answer, buffer, cluelist, title, author, copyright, notes)
 
+def positive(string):
+    value = float(string)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f'{string} is not positive')
+    return value
+
 if __name__ == '__main__':
-    puzzle = parse(sys.argv[1])
-    puzzle.run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename')
+    parser.add_argument('--log',
+                        help='where to record the session '
+                             '(defaults to a timestamped file next to the puzzle)')
+    parser.add_argument('--replay', metavar='LOG',
+                        help='play back a recorded session instead of solving')
+    parser.add_argument('--speed', type=positive, default=1.0,
+                        help='playback speed multiplier for --replay')
+    parser.add_argument('--seek', type=float, default=0.0, metavar='SECONDS',
+                        help='start --replay this many seconds into the session')
+    args = parser.parse_args()
+
+    puzzle = parse(args.filename)
+    if args.replay is not None:
+        Replay(puzzle, args.replay).play(speed=args.speed, seek=args.seek)
+    else:
+        log = args.log
+        if log is None:
+            stem = os.path.splitext(args.filename)[0]
+            log  = stem + time.strftime('.%Y%m%d-%H%M%S.xwl')
+        puzzle.run(log)